@@ -4,11 +4,18 @@ Uses the latest Qiskit SDK 2.x and Qiskit Runtime API (2025)
 """
 
 import os
-from qiskit import QuantumCircuit
+import sys
+import asyncio
+import functools
+import hashlib
+import io
+import math
+from collections import Counter
+import numpy as np
+from qiskit import QuantumCircuit, qpy, transpile
 from qiskit.transpiler import generate_preset_pass_manager
-from qiskit_ibm_runtime import QiskitRuntimeService, SamplerV2 as Sampler
-from qiskit.visualization import plot_histogram
-import matplotlib.pyplot as plt
+from qiskit_ibm_runtime import Batch, QiskitRuntimeService, SamplerV2 as Sampler
+from qiskit_ibm_runtime.exceptions import IBMError, RuntimeJobFailureError
 
 # ============================================================================
 # STEP 1: Authenticate with IBM Quantum Platform
@@ -35,6 +42,9 @@ def setup_quantum_service():
 # ============================================================================
 # STEP 2: Create Quantum Circuit for Random Number Generation
 # ============================================================================
+_CIRCUIT_CACHE = {}  # num_qubits -> template QuantumCircuit
+
+
 def create_qrng_circuit(num_qubits=8):
     """
     Creates a quantum circuit that generates random bits using quantum superposition.
@@ -52,18 +62,26 @@ def create_qrng_circuit(num_qubits=8):
     """
     print(f"🔬 Creating quantum circuit with {num_qubits} qubits...")
 
-    # Create a quantum circuit with specified number of qubits
-    qc = QuantumCircuit(num_qubits)
+    # The circuit only depends on num_qubits, so build each size once
+    # and hand out copies so callers can't modify the cached template
+    # (QuantumCircuit.copy() is about 2x faster than reloading a QPY blob)
+    if num_qubits not in _CIRCUIT_CACHE:
+        # Create a quantum circuit with specified number of qubits
+        # and one classical bit per qubit to hold the measurement results
+        qc = QuantumCircuit(num_qubits, num_qubits)
+
+        # Apply Hadamard gate to every qubit in a single call
+        # H gate creates equal superposition: |0⟩ → (|0⟩ + |1⟩)/√2
+        # This is the quantum "randomness" - each qubit is in superposition
+        qc.h(range(num_qubits))
 
-    # Apply Hadamard gate to each qubit
-    # H gate creates equal superposition: |0⟩ → (|0⟩ + |1⟩)/√2
-    # This is the quantum "randomness" - each qubit is in superposition
-    for qubit in range(num_qubits):
-        qc.h(qubit)
+        # Measure all qubits in a single call - this collapses the superposition
+        # Each measurement gives a truly random 0 or 1 based on quantum mechanics
+        qc.measure(range(num_qubits), range(num_qubits))
 
-    # Measure all qubits - this collapses the superposition
-    # Each measurement gives a truly random 0 or 1 based on quantum mechanics
-    qc.measure_all()
+        _CIRCUIT_CACHE[num_qubits] = qc
+
+    qc = _CIRCUIT_CACHE[num_qubits].copy()
 
     print("✅ Quantum circuit created!")
     print(f"   Circuit will generate random numbers from 0 to {2**num_qubits - 1}")
@@ -71,20 +89,109 @@ def create_qrng_circuit(num_qubits=8):
     return qc
 
 
+# ============================================================================
+# Transpilation cache (skips the pass manager on repeated runs)
+# ============================================================================
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "qrng")
+_ISA_CACHE = {}  # cache key -> transpiled circuit, for repeated calls in one process
+
+
+def _get_isa_circuit(backend, circuit, opt_level):
+    """
+    Returns the circuit transpiled for the backend, reusing a cached copy if one exists.
+
+    The transpiled (ISA) circuit is stored on disk as a QPY file keyed by a hash
+    of the circuit, the backend name, its device version and native gates, and
+    the optimization level, so running the script again against the same
+    backend skips transpilation.
+    Within one process the circuit is also kept in memory, so repeated jobs
+    (e.g. several draws in a Batch) don't even reload the QPY file.
+    """
+    # Hash a copy with a fixed name: Qiskit's auto-generated names ("circuit-46")
+    # depend on how many circuits were created earlier in the process
+    buffer = io.BytesIO()
+    qpy.dump(circuit.copy(name="qrng"), buffer)
+    # backend_version is the device's version; backend.version is only the
+    # BackendV2 interface version (always 2) and would never invalidate the cache
+    key = hashlib.sha1(
+        buffer.getvalue()
+        + backend.name.encode()
+        + str(getattr(backend, "backend_version", None)).encode()
+        + ",".join(sorted(backend.target.operation_names)).encode()
+        + str(opt_level).encode()
+    ).hexdigest()
+    if key in _ISA_CACHE:
+        return _ISA_CACHE[key]
+
+    cache_path = os.path.join(CACHE_DIR, f"{backend.name}_{circuit.num_qubits}_{opt_level}_{key}.qpy")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                isa_circuit = qpy.load(f)[0]
+            print("♻️  Reusing cached transpiled circuit")
+            _ISA_CACHE[key] = isa_circuit
+            return isa_circuit
+        except Exception:
+            # Corrupt or incompatible cache entry - fall through and rebuild it
+            pass
+
+    # Every qubit is independent (H + measure only), so a trivial layout with no
+    # routing is already optimal - skip the layout search and routing passes
+    pm = generate_preset_pass_manager(
+        backend=backend,
+        optimization_level=opt_level,
+        layout_method="trivial",
+        routing_method="none",
+    )
+    isa_circuit = pm.run(circuit)
+    _ISA_CACHE[key] = isa_circuit
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            qpy.dump(isa_circuit, f)
+    except OSError:
+        # Caching is best-effort; a read-only home directory shouldn't stop the run
+        pass
+
+    return isa_circuit
+
+
 # ============================================================================
 # STEP 3: Execute on Real Quantum Hardware
 # ============================================================================
-def execute_on_quantum_hardware(service, circuit, num_shots=1024):
+DEFAULT_MAX_SHOTS = 100_000  # Typical per-circuit shot cap on IBM Quantum backends
+
+# Errors that mean real hardware is unavailable (bad token, quota used up,
+# rate limited, ...) - in "auto" mode these trigger the local simulator
+HARDWARE_ERRORS = (IBMError, RuntimeJobFailureError)
+
+
+def _split_shots(num_shots, max_shots):
     """
-    Executes the quantum circuit on real IBM quantum hardware.
+    Splits a total shot count into per-circuit shot counts no larger than max_shots.
+
+    Example: 250,000 shots with a 100,000 cap → [83334, 83333, 83333]
+    """
+    num_pubs = max(1, math.ceil(num_shots / max_shots))
+    per_pub, remainder = divmod(num_shots, num_pubs)
+    return [per_pub + 1] * remainder + [per_pub] * (num_pubs - remainder)
+
+
+def select_backend(service):
+    """
+    Picks the least busy real quantum computer.
+
+    This queries IBM Quantum over the network, so call it once and pass the
+    backend to every execute_on_quantum_hardware call rather than re-selecting
+    for each job.
 
     Args:
         service: QiskitRuntimeService instance
-        circuit: QuantumCircuit to execute
-        num_shots: Number of times to run the circuit (more shots = more random numbers)
 
     Returns:
-        Dictionary of measurement results (counts of each binary outcome)
+        Backend to run circuits on
     """
     print("\n🚀 Preparing to run on quantum hardware...")
 
@@ -96,12 +203,21 @@ def execute_on_quantum_hardware(service, circuit, num_shots=1024):
     print(f"   Number of qubits: {backend.num_qubits}")
     print(f"   Quantum volume: {backend.quantum_volume if hasattr(backend, 'quantum_volume') else 'N/A'}")
 
+    return backend
+
+
+def _submit_to_quantum_hardware(backend, circuit, num_shots, session=None):
+    """
+    Transpiles the circuit for the backend and submits it without waiting.
+
+    Returns:
+        Tuple of (submitted job, backend name)
+    """
     # Transpile the circuit for the specific backend
-    # This optimizes and adapts the circuit to the hardware's native gates
-    # optimization_level=1 balances speed and optimization
+    # This adapts the circuit to the hardware's native gates
+    # optimization_level=0 is enough: H + measure has nothing to optimize
     print("\n🔧 Transpiling circuit for target hardware...")
-    pm = generate_preset_pass_manager(backend=backend, optimization_level=1)
-    isa_circuit = pm.run(circuit)
+    isa_circuit = _get_isa_circuit(backend, circuit, opt_level=0)
 
     print(f"✅ Transpilation complete!")
     print(f"   Original circuit depth: {circuit.depth()}")
@@ -112,98 +228,438 @@ def execute_on_quantum_hardware(service, circuit, num_shots=1024):
     print(f"\n⚛️  Submitting job to quantum computer ({num_shots} shots)...")
     print("   ⏳ This may take a few moments as your job waits in the queue...")
 
-    sampler = Sampler(mode=backend)
-    sampler.options.default_shots = num_shots
+    # Split the shots into copies of the circuit that each respect the backend's
+    # shot limit - all copies are submitted together as one job
+    max_shots = getattr(backend, "max_shots", None) or DEFAULT_MAX_SHOTS
+    shots_per_pub = _split_shots(num_shots, max_shots)
+    pubs = [(isa_circuit, None, shots) for shots in shots_per_pub]
+    if len(pubs) > 1:
+        print(f"   Splitting into {len(pubs)} circuits (max {max_shots} shots each)")
+
+    # Inside a Batch/Session, jobs after the first skip the public queue
+    sampler = Sampler(mode=session if session is not None else backend)
 
     # Submit the job
-    job = sampler.run([isa_circuit])
+    job = sampler.run(pubs)
     print(f"   Job ID: {job.job_id()}")
     print("   Status: Job submitted - waiting for execution...")
 
-    # Wait for results
-    result = job.result()
-    print("✅ Quantum execution complete!")
+    return job, backend.name
 
-    # Extract the measurement counts from the result
-    # pub_result[0] gets the first (and only) result
-    # .data.meas accesses the measurement register
+
+def _bitstrings_to_bits(bitstrings):
+    """
+    Converts a list of equal-length bitstrings (one per shot) into a bit array.
+
+    Returns:
+        uint8 array of shape (num_shots, num_bits) holding 0s and 1s, most
+        significant bit first, rows in shot order
+    """
+    if not bitstrings:
+        return np.zeros((0, 0), dtype=np.uint8)
+    num_bits = len(bitstrings[0])
+    buffer = "".join(bitstrings).encode("ascii")
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(len(bitstrings), num_bits) - 0x30
+
+
+def _data_from_result(result):
+    """
+    Merges the measurements of every circuit copy in a Sampler result.
+
+    Returns:
+        Tuple of (counts dictionary, per-shot bits in shot order - see _bitstrings_to_bits)
+    """
+    # Each pub_result holds the outcomes of one circuit copy
+    # .data.c accesses the classical register holding the measurements
     # .get_counts() converts to a dictionary format
-    pub_result = result[0]
-    counts = pub_result.data.meas.get_counts()
+    # .array holds every shot's bits packed into bytes (last byte = lowest bits)
+    counts = Counter()
+    shot_bits = []
+    for pub_result in result:
+        bit_array = pub_result.data.c
+        counts.update(bit_array.get_counts())
+        shot_bits.append(np.unpackbits(bit_array.array, axis=-1)[:, -bit_array.num_bits:])
+
+    return dict(counts), np.concatenate(shot_bits)
+
+
+def execute_on_simulator(circuit, num_shots=1024):
+    """
+    Executes the quantum circuit on the local Qiskit Aer simulator.
 
-    return counts, backend.name
+    Useful for development and demos: no queue, no quantum time used, and for
+    an H + measure circuit the outcome distribution is the same as on hardware.
+    Requires the optional qiskit-aer package.
+
+    Returns:
+        Tuple of (counts dictionary, backend name, per-shot bits in shot order)
+    """
+    try:
+        from qiskit_aer import AerSimulator
+    except ImportError as e:
+        raise ImportError("Simulator mode requires qiskit-aer: pip install qiskit-aer") from e
+
+    print(f"\n💻 Running on local simulator ({num_shots} shots)...")
+    simulator = AerSimulator()
+    sim_circuit = transpile(circuit, simulator)
+    # memory=True keeps every shot's outcome in order, not just the counts
+    sim_result = simulator.run(sim_circuit, shots=num_shots, memory=True).result()
+    counts = sim_result.get_counts()
+    shot_bits = _bitstrings_to_bits(sim_result.get_memory())
+    print("✅ Simulation complete!")
+
+    return counts, simulator.name, shot_bits
+
+
+def execute_on_quantum_hardware(backend, circuit, num_shots=1024, session=None, mode="hardware"):
+    """
+    Executes the quantum circuit on real IBM quantum hardware.
+
+    If num_shots exceeds the backend's per-circuit shot limit, the circuit is
+    repeated inside a single job so only one queue wait is paid.
+
+    Args:
+        backend: Backend from select_backend() (unused in "simulator" mode)
+        circuit: QuantumCircuit to execute
+        num_shots: Total number of times to run the circuit (more shots = more random numbers)
+        session: Optional open Batch or Session to run the job in (opened on backend)
+        mode: "hardware" (default), "simulator" to run locally with Qiskit Aer,
+              or "auto" to fall back to the simulator if hardware is unavailable
+
+    Returns:
+        Tuple of (counts of each binary outcome, backend name, per-shot bits
+        in shot order as a (num_shots, num_bits) uint8 array)
+    """
+    if mode not in ("hardware", "simulator", "auto"):
+        raise ValueError(f"Unknown mode {mode!r}: expected 'hardware', 'simulator' or 'auto'")
+
+    if mode == "simulator":
+        return execute_on_simulator(circuit, num_shots)
+
+    try:
+        job, backend_name = _submit_to_quantum_hardware(backend, circuit, num_shots, session)
+
+        # Wait for results
+        result = job.result()
+    except HARDWARE_ERRORS as e:
+        if mode != "auto":
+            raise
+        print(f"\n⚠️  Quantum hardware unavailable ({e}) - falling back to simulator")
+        return execute_on_simulator(circuit, num_shots)
+
+    print("✅ Quantum execution complete!")
+
+    counts, shot_bits = _data_from_result(result)
+    return counts, backend_name, shot_bits
+
+
+async def execute_on_quantum_hardware_async(backend, circuit, num_shots=1024, session=None,
+                                            mode="hardware", poll_interval=5):
+    """
+    Non-blocking version of execute_on_quantum_hardware for use with asyncio.
+
+    Instead of blocking in job.result() while the job waits in the queue, the
+    job status is polled every poll_interval seconds so other coroutines
+    (e.g. processing results of jobs that already finished) can run meanwhile.
+    mode works as in execute_on_quantum_hardware; the simulator runs in a
+    worker thread so it doesn't block the event loop either.
+
+    Returns:
+        Tuple of (counts dictionary, backend name, per-shot bits in shot order)
+    """
+    if mode not in ("hardware", "simulator", "auto"):
+        raise ValueError(f"Unknown mode {mode!r}: expected 'hardware', 'simulator' or 'auto'")
+
+    if mode == "simulator":
+        return await asyncio.to_thread(execute_on_simulator, circuit, num_shots)
+
+    try:
+        # Submission makes network calls, so run it off the event loop
+        job, backend_name = await asyncio.to_thread(
+            _submit_to_quantum_hardware, backend, circuit, num_shots, session
+        )
+
+        # Wait for results without blocking the event loop
+        # Status checks are REST calls, so they also run in a thread. Stop at any
+        # final state (DONE, ERROR, CANCELLED) - job.result() then raises on failure
+        while not await asyncio.to_thread(job.in_final_state):
+            await asyncio.sleep(poll_interval)
+        result = await asyncio.to_thread(job.result)
+    except HARDWARE_ERRORS as e:
+        if mode != "auto":
+            raise
+        print(f"\n⚠️  Quantum hardware unavailable ({e}) - falling back to simulator")
+        return await asyncio.to_thread(execute_on_simulator, circuit, num_shots)
+
+    print(f"✅ Quantum execution complete! (Job ID: {job.job_id()})")
+
+    counts, shot_bits = _data_from_result(result)
+    return counts, backend_name, shot_bits
+
+
+async def execute_in_queue(backend, params, num_workers=4, mode="hardware"):
+    """
+    Runs many independent QRNG jobs concurrently using a pool of asyncio workers.
+
+    Example:
+        backend = select_backend(service)
+        params = [(create_qrng_circuit(6), 1024) for _ in range(10)]
+        results = asyncio.run(execute_in_queue(backend, params))
+
+    Args:
+        backend: Backend from select_backend()
+        params: List of (circuit, num_shots) tuples, one per job
+        num_workers: Maximum number of jobs waiting in the IBM queue at once
+        mode: "hardware", "simulator" or "auto", as in execute_on_quantum_hardware
+
+    Returns:
+        List of (counts, backend name, per-shot bits) tuples in the same order as params
+    """
+    queue = asyncio.Queue()
+    for index, (circuit, num_shots) in enumerate(params):
+        queue.put_nowait((index, circuit, num_shots))
+
+    results = [None] * len(params)
+
+    async def worker():
+        while True:
+            try:
+                index, circuit, num_shots = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                results[index] = await execute_on_quantum_hardware_async(
+                    backend, circuit, num_shots, mode=mode
+                )
+            finally:
+                queue.task_done()
+
+    await asyncio.gather(*(worker() for _ in range(num_workers)))
+
+    return results
 
 
 # ============================================================================
 # STEP 4: Convert Quantum Measurements to Random Numbers
 # ============================================================================
-def extract_random_numbers(counts):
+LUT_MAX_BITS = 10  # Up to 1024 outcomes: a lookup table beats bulk bit-packing
+
+
+@functools.lru_cache(maxsize=None)
+def _bitstring_lut(num_bits):
+    """
+    Returns a dictionary mapping every num_bits-long binary string to its integer value.
+    """
+    return {format(i, f"0{num_bits}b"): i for i in range(1 << num_bits)}
+
+
+def _parse_counts(counts):
+    """
+    Parses a counts dictionary into NumPy arrays, converting each binary key once.
+
+    For small circuits every possible key is looked up in a prebuilt table.
+    Otherwise all keys (which have the same length) are joined into one ASCII
+    buffer, turned into a (num_outcomes, num_bits) array of 0/1 bytes and
+    packed into integers with np.packbits - no per-key int(k, 2) parsing.
+
+    Returns:
+        Tuple of (decimal values, frequencies) as int64 arrays in counts order
+    """
+    num_outcomes = len(counts)
+    frequencies = np.fromiter(counts.values(), dtype=np.int64, count=num_outcomes)
+    if num_outcomes == 0:
+        return np.zeros(0, dtype=np.int64), frequencies
+
+    num_bits = len(next(iter(counts)))
+    if num_bits <= LUT_MAX_BITS:
+        lut = _bitstring_lut(num_bits)
+        try:
+            values = np.fromiter(map(lut.__getitem__, counts), dtype=np.int64, count=num_outcomes)
+            return values, frequencies
+        except KeyError:
+            # Keys of mixed length or with spaces - handled below
+            pass
+
+    buffer = "".join(counts).encode("ascii")
+    bits = None
+    if num_bits <= 63 and len(buffer) == num_outcomes * num_bits:
+        bits = np.frombuffer(buffer, dtype=np.uint8).reshape(num_outcomes, num_bits) - 0x30
+
+    if bits is None or bits.max() > 1:
+        # Unusual keys (e.g. several registers separated by spaces) - parse one by one
+        values = np.fromiter((int(k.replace(" ", ""), 2) for k in counts), dtype=np.int64, count=num_outcomes)
+        return values, frequencies
+
+    # Right-align the bits in 64-bit rows, pack to 8 bytes each and read as big-endian ints
+    padded = np.zeros((num_outcomes, 64), dtype=np.uint8)
+    padded[:, 64 - num_bits:] = bits
+    values = np.packbits(padded, axis=1).view(">u8").ravel().astype(np.int64)
+    return values, frequencies
+
+
+def extract_random_numbers(counts, seed=None):
     """
     Converts binary measurement outcomes to decimal random numbers.
 
     Args:
         counts: Dictionary of measurement outcomes from quantum hardware
+        seed: Optional seed (or np.random.Generator) for the shuffle, to make
+              the order reproducible - the numbers themselves come from the QPU
 
     Returns:
-        List of random numbers (shuffled to show true randomness)
+        NumPy int64 array of random numbers (shuffled to show true randomness)
     """
     print("\n🎲 Converting quantum measurements to random numbers...")
 
-    import random as classical_random
-    random_numbers = []
-
     # Each key in counts is a binary string (e.g., "10110101")
     # Each value is how many times that outcome was measured
-    for binary_string, count in counts.items():
-        # Convert binary string to decimal integer
-        decimal_value = int(binary_string, 2)
+    # Parse every distinct outcome once, then let NumPy expand them
+    values, frequencies = _parse_counts(counts)
 
-        # Add this number 'count' times to our list
-        random_numbers.extend([decimal_value] * count)
+    # Repeat each number 'count' times in a single vectorized call
+    random_numbers = np.repeat(values, frequencies)
 
-    # Shuffle the list to show the true random distribution
+    # Shuffle the array in place to show the true random distribution
     # (without shuffling, grouped outcomes might make it look non-random)
-    classical_random.shuffle(random_numbers)
+    # Generator.shuffle runs Fisher-Yates in C directly on the int64 buffer
+    rng = np.random.default_rng(seed)
+    rng.shuffle(random_numbers)
 
     print(f"✅ Generated {len(random_numbers)} random numbers!")
 
     return random_numbers
 
 
+def von_neumann_extract(shot_bits):
+    """
+    Removes bias from the measured bits using the von Neumann extractor.
+
+    Real hardware is slightly biased (e.g. readout errors favour 0), so the raw
+    bits aren't perfectly uniform. Each qubit's bits from consecutive shots are
+    paired up: 01 → 0, 10 → 1, and 00 / 11 are discarded. As long as the shots
+    are independent, the surviving bits are unbiased. A bit with P(1) = p is
+    kept with probability p(1 - p), so on average at most a quarter of the
+    bits survive (the exact number varies from run to run).
+
+    This must be given the bits in the order the shots were measured - the
+    per-shot output of the execute functions - not numbers rebuilt from
+    counts, whose order would come from a classical shuffle.
+
+    Args:
+        shot_bits: (num_shots, num_qubits) 0/1 array in shot order, as returned
+                   by execute_on_quantum_hardware() / execute_on_simulator()
+
+    Returns:
+        uint8 array of unbiased bits (0 or 1)
+    """
+    num_pairs = len(shot_bits) // 2
+    first = shot_bits[0:2 * num_pairs:2]
+    second = shot_bits[1:2 * num_pairs:2]
+    return first[first != second]
+
+
+def get_random_bits(shot_bits, debias=False):
+    """
+    Returns the measured random bits as a packed byte buffer.
+
+    The bits are taken straight from the per-shot measurements in the order
+    they were measured, so the output depends only on the quantum hardware.
+    Handy when the randomness is consumed as raw bits, e.g. as a seed:
+        counts, backend_name, shot_bits = execute_on_quantum_hardware(backend, circuit)
+        np.random.default_rng(int.from_bytes(get_random_bits(shot_bits).tobytes(), "big"))
+
+    Args:
+        shot_bits: (num_shots, num_qubits) 0/1 array in shot order, as returned
+                   by execute_on_quantum_hardware() / execute_on_simulator()
+        debias: Run the bits through von_neumann_extract() first
+
+    Returns:
+        uint8 array with 8 bits per byte (most significant bit first). If the
+        number of bits isn't a multiple of 8, the last byte is padded with 0s.
+    """
+    if debias:
+        bits = von_neumann_extract(shot_bits)
+    else:
+        bits = np.asarray(shot_bits, dtype=np.uint8).ravel()
+    return np.packbits(bits)
+
+
 # ============================================================================
 # STEP 5: Display Results
 # ============================================================================
-def display_results(counts, random_numbers, backend_name, num_qubits):
+def _top_outcomes(frequencies, n):
+    """
+    Returns the indices of the n largest frequencies, most common first.
+
+    np.partition finds the cut-off in O(M) without sorting every outcome (and
+    is much faster than heapq.nlargest over counts.items() for large M). Ties
+    keep their order in counts, matching sorted(..., reverse=True).
+    """
+    n = min(n, len(frequencies))
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+    threshold = np.partition(frequencies, -n)[-n]
+    above = np.flatnonzero(frequencies > threshold)
+    tied = np.flatnonzero(frequencies == threshold)[:n - len(above)]
+    top = np.sort(np.concatenate((above, tied)))
+    return top[np.argsort(-frequencies[top], kind="stable")]
+
+
+def display_results(counts, backend_name, num_qubits):
     """
     Display the quantum random number generation results with statistics.
+
+    Everything is computed from the counts (one entry per distinct outcome),
+    so memory use doesn't grow with the number of shots.
     """
+    # Parse the outcomes once into value/frequency arrays
+    keys = list(counts)
+    values, frequencies = _parse_counts(counts)
+    total = int(frequencies.sum())
+
     print("\n" + "="*70)
     print("🎯 QUANTUM RANDOM NUMBER GENERATOR - RESULTS")
     print("="*70)
     print(f"Backend Used: {backend_name}")
-    print(f"Total Measurements: {len(random_numbers)}")
+    print(f"Total Measurements: {total}")
     print(f"Number Range: 0 to {2**num_qubits - 1}")
-    print(f"Unique Values Generated: {len(set(random_numbers))}")
-    print("\n📊 Sample Random Numbers (first 20):")
-    print(random_numbers[:20])
+    print(f"Unique Values Generated: {len(counts)}")
 
     # Calculate basic statistics
-    if random_numbers:
+    if total:
+        # Draw a few numbers from the measured distribution for display
+        sample = np.random.default_rng().choice(values, size=20, p=frequencies / total)
+        print("\n📊 Sample Random Numbers (20 drawn from the results):")
+        print(sample.tolist())
+
         print(f"\n📈 Statistics:")
-        print(f"   Min: {min(random_numbers)}")
-        print(f"   Max: {max(random_numbers)}")
-        print(f"   Mean: {sum(random_numbers)/len(random_numbers):.2f}")
+        print(f"   Min: {values.min()}")
+        print(f"   Max: {values.max()}")
+        print(f"   Mean: {(values * frequencies).sum() / total:.2f}")
+
+    # Dense histogram indexed by decimal value
+    histogram = np.zeros(2**num_qubits, dtype=np.int64)
+    histogram[values] = frequencies
 
     print("\n🔬 Measurement Distribution:")
     # Show top 10 most common outcomes
-    sorted_counts = sorted(counts.items(), key=lambda x: x[1], reverse=True)[:10]
-    for binary, count in sorted_counts:
-        decimal = int(binary, 2)
-        percentage = (count / len(random_numbers)) * 100
-        print(f"   {binary} (decimal: {decimal:3d}) → {count:4d} times ({percentage:.1f}%)")
+    for index in _top_outcomes(frequencies, 10):
+        count = frequencies[index]
+        percentage = (count / total) * 100
+        print(f"   {keys[index]} (decimal: {values[index]:3d}) → {count:4d} times ({percentage:.1f}%)")
 
     # Visualize the distribution
+    # Plotting libraries are imported here so code that only needs the random
+    # numbers doesn't pay their import cost. The plot window only opens with
+    # QRNG_SHOW=1; otherwise a non-interactive backend just writes the PNG.
     print("\n📊 Generating histogram...")
+    show = os.environ.get("QRNG_SHOW") == "1"
+    import matplotlib
+    if not show and "matplotlib.pyplot" not in sys.modules:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from qiskit.visualization import plot_histogram
+
     fig = plot_histogram(counts, figsize=(12, 6),
                         title=f'Quantum Random Number Distribution\n(Backend: {backend_name})')
 
@@ -211,13 +667,15 @@ def display_results(counts, random_numbers, backend_name, num_qubits):
     if fig is not None:
         fig.savefig('qrng_results.png', dpi=150, bbox_inches='tight')
         print("✅ Histogram saved as 'qrng_results.png'")
-        plt.show()
+        if show:
+            plt.show()
     else:
         # Alternative: Create histogram using matplotlib directly
         plt.figure(figsize=(12, 6))
-        values = [int(k, 2) for k in counts.keys()]
-        frequencies = list(counts.values())
-        plt.bar(values, frequencies, color='#1f77b4', edgecolor='black', alpha=0.7)
+        # The histogram is dense, so draw it as one filled step outline
+        # instead of creating a separate bar patch for every value
+        edges = np.arange(len(histogram) + 1) - 0.5
+        plt.stairs(histogram, edges, fill=True, color='#1f77b4', alpha=0.7)
         plt.xlabel('Random Number Value', fontsize=12)
         plt.ylabel('Frequency (Number of Occurrences)', fontsize=12)
         plt.title(f'Quantum Random Number Distribution\n(Backend: {backend_name})', fontsize=14, fontweight='bold')
@@ -225,7 +683,8 @@ def display_results(counts, random_numbers, backend_name, num_qubits):
         plt.tight_layout()
         plt.savefig('qrng_results.png', dpi=150, bbox_inches='tight')
         print("✅ Histogram saved as 'qrng_results.png'")
-        plt.show()
+        if show:
+            plt.show()
 
 
 # ============================================================================
@@ -243,10 +702,19 @@ def main():
     # Configuration
     NUM_QUBITS = 6    # 5 qubits = random numbers from 0 to 31
     NUM_SHOTS = 1024  # Number of measurements (more = more random numbers)
+    NUM_DRAWS = 1     # Number of jobs to run inside one Batch (results are combined)
+    MODE = "hardware" # "hardware", "simulator" (local, needs qiskit-aer) or "auto"
 
     try:
-        # Step 1: Setup connection to IBM Quantum
-        service = setup_quantum_service()
+        # Step 1: Setup connection to IBM Quantum (not needed for the simulator)
+        service = None
+        if MODE != "simulator":
+            try:
+                service = setup_quantum_service()
+            except HARDWARE_ERRORS as e:
+                if MODE != "auto":
+                    raise
+                print(f"\n⚠️  Quantum hardware unavailable ({e}) - falling back to simulator")
 
         # Step 2: Create the quantum circuit
         circuit = create_qrng_circuit(num_qubits=NUM_QUBITS)
@@ -256,21 +724,50 @@ def main():
         print(circuit.draw(output='text'))
 
         # Step 3: Execute on quantum hardware
-        counts, backend_name = execute_on_quantum_hardware(
-            service, circuit, num_shots=NUM_SHOTS
-        )
+        counts = None
+        if service is not None:
+            try:
+                # Pick the backend once - every draw reuses it
+                backend = select_backend(service)
+
+                # All draws share one Batch, so only the first job waits in the queue
+                draw_counts_total = Counter()
+                draw_shot_bits = []
+                with Batch(backend=backend) as batch:
+                    for _ in range(NUM_DRAWS):
+                        draw_counts, backend_name, draw_bits = execute_on_quantum_hardware(
+                            backend, circuit, num_shots=NUM_SHOTS, session=batch
+                        )
+                        draw_counts_total.update(draw_counts)
+                        draw_shot_bits.append(draw_bits)
+                counts = dict(draw_counts_total)
+                shot_bits = np.concatenate(draw_shot_bits)
+            except HARDWARE_ERRORS as e:
+                if MODE != "auto":
+                    raise
+                print(f"\n⚠️  Quantum hardware unavailable ({e}) - falling back to simulator")
+
+        if counts is None:
+            counts, backend_name, shot_bits = execute_on_simulator(circuit, num_shots=NUM_SHOTS * NUM_DRAWS)
 
         # Step 4: Convert to random numbers
         random_numbers = extract_random_numbers(counts)
 
+        # Hardware bits are slightly biased - show how many unbiased bits remain
+        # (run on the bits in measured shot order, not the shuffled numbers)
+        unbiased_bits = von_neumann_extract(shot_bits)
+        print(f"🧹 Von Neumann extractor kept {len(unbiased_bits)} unbiased bits "
+              f"out of {shot_bits.size}")
+
         # Step 5: Display results
-        display_results(counts, random_numbers, backend_name, NUM_QUBITS)
+        display_results(counts, backend_name, NUM_QUBITS)
 
         print("\n" + "="*70)
         print("✨ Quantum Random Number Generation Complete!")
         print("="*70)
 
-        return random_numbers
+        # Hand back plain Python ints to callers of the script
+        return random_numbers.tolist()
 
     except Exception as e:
         print(f"\n❌ Error occurred: {str(e)}")